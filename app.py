@@ -1,12 +1,22 @@
 import os
+import sys
+import json
+import time
+import cProfile
+import pstats
+import uuid
+import threading
+import multiprocessing
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify, g, has_request_context
 from flask_wtf.csrf import CSRFProtect
 import firebase_admin
 from firebase_admin import credentials, db, auth
 from collections import defaultdict
 import csv
 from io import StringIO
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from flask_wtf.csrf import validate_csrf
 #test
 # Initialize Flask
@@ -14,6 +24,55 @@ app = Flask(__name__)
 app.secret_key = 'your-secure-dev-key-123'
 csrf = CSRFProtect(app)
 
+# Report settings
+REPORT_WORKERS = os.cpu_count() or 1
+REPORT_PARALLEL_MIN_SALES = 2000   # below this, pool overhead outweighs the gain
+REPORT_JOB_TTL = 3600              # seconds a finished background report is kept
+REPORT_JOB_TIMEOUT = 900           # seconds before a still-running job is reported as failed
+REPORT_RESULT_CHUNK = 2000         # sales per stored result chunk (RTDB caps strings at 10 MB)
+
+# Profiling settings
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+PROFILE_SAMPLE_INTERVAL = 0.005    # seconds between stack samples in 'sample' mode
+PROFILE_MAX_COUNT = 100            # most requests one arm call may profile
+PROFILE_MAX_CAPTURES = 200         # oldest captures are deleted beyond this
+
+# Reservation settings
+RESERVATION_TTL = 600              # seconds a cart/checkout hold keeps stock aside
+RESERVATION_SWEEP_INTERVAL = 60    # seconds between background sweeps of expired holds
+
+# Store settings
+DEFAULT_STORE = os.environ.get('DEFAULT_STORE', 'main')
+ALL_STORES = 'all'
+
+def load_store_config():
+    """Load the store -> shard mapping from STORES_CONFIG (a JSON file), if set.
+
+    Each store may set 'name', 'prefix' (the shard path its trees live under)
+    and 'database_url' (a separate database instance). The default store keeps
+    the legacy root-level trees.
+    """
+    path = os.environ.get('STORES_CONFIG')
+    if path:
+        with open(path) as f:
+            stores = json.load(f)
+    else:
+        stores = {DEFAULT_STORE: {'name': 'Main Store'}}
+
+    if DEFAULT_STORE not in stores:
+        raise ValueError(
+            f"STORES_CONFIG must define the default store '{DEFAULT_STORE}' "
+            f"(set DEFAULT_STORE to one of: {', '.join(stores)})"
+        )
+
+    for store_id, config in stores.items():
+        config.setdefault('name', store_id)
+        config.setdefault('prefix', '' if store_id == DEFAULT_STORE else f'stores/{store_id}')
+        config.setdefault('database_url', None)
+    return stores
+
+STORES = load_store_config()
+
 # Initialize Firebase
 cred = credentials.Certificate("/home/elerock/Documents/biterite homepage/program/firebase/webapp2/credentials.json")
 firebase_admin.initialize_app(cred, {
@@ -62,6 +121,8 @@ def inject_helpers():
 
     return dict(
         datetime=datetime,
+        stores=STORES,
+        current_store=get_current_store(),
         get_product_name=lambda products, pid: products.get(pid, {}).get('name', '[Deleted Product]'),
         get_cart=get_cart,
         calculate_cart_total=calculate_cart_total,
@@ -79,27 +140,69 @@ def datetimeformat(value, format="%b %d, %Y %I:%M %p"):
     except:
         return "N/A"
 
+# ----------------- Store Helpers -----------------
+def get_current_store():
+    """Resolve the active store from the query string, session or default"""
+    store_id = request.args.get('store') or session.get('store_id') or DEFAULT_STORE
+    return store_id if store_id in STORES else DEFAULT_STORE
+
+@app.before_request
+def remember_store_selection():
+    """Keep an explicit ?store= for later redirects and AJAX posts"""
+    store_id = request.args.get('store')
+    if store_id in STORES and session.get('store_id') != store_id:
+        session['store_id'] = store_id
+
+def store_ref(path='', store_id=None):
+    """Database reference for a path inside a store's shard"""
+    store = STORES[store_id or get_current_store()]
+    full_path = '/'.join(part for part in (store['prefix'], path) if part) or '/'
+    return db.reference(full_path, url=store['database_url'])
+
+def fetch_store_trees(store_ids, paths=('products', 'sales')):
+    """Read the given trees from several store shards in parallel"""
+    with ThreadPoolExecutor(max_workers=max(len(store_ids), 1)) as pool:
+        futures = {
+            (store_id, path): pool.submit(lambda s, p: store_ref(p, s).get() or {}, store_id, path)
+            for store_id in store_ids for path in paths
+        }
+    trees = defaultdict(dict)
+    for (store_id, path), future in futures.items():
+        try:
+            trees[store_id][path] = future.result()
+        except Exception as e:
+            if not has_request_context():
+                raise
+            flash(f"Database error ({STORES[store_id]['name']}): {str(e)}", "danger")
+            trees[store_id][path] = {}
+    return trees
+
 # ----------------- Cart Helpers -----------------
+def cart_key():
+    """Session key holding the cart for the active store"""
+    store_id = get_current_store()
+    return 'cart' if store_id == DEFAULT_STORE else f'cart_{store_id}'
+
 def get_cart():
     """Get current cart from session"""
-    return session.get('cart', {})
+    return session.get(cart_key(), {})
 
 def update_cart(pid, quantity):
     """Update cart with proper session modification tracking"""
-    cart = session.get('cart', {})
+    cart = session.get(cart_key(), {})
     
     if quantity > 0:
         cart[pid] = quantity
     else:
         cart.pop(pid, None)
     
-    session['cart'] = cart
+    session[cart_key()] = cart
     session.modified = True
     return True
 
 def clear_cart():
     """Empty the cart completely"""
-    session.pop('cart', None)
+    session.pop(cart_key(), None)
     session.modified = True
 
 def calculate_cart_total():
@@ -122,32 +225,440 @@ def calculate_cart_total():
 
 
 # ----------------- Firebase Helpers -----------------
-def get_firebase_data(path):
+def get_firebase_data(path, store_id=None):
     """Safe data retrieval with error handling"""
     try:
-        return db.reference(path).get() or {}
+        return store_ref(path, store_id).get() or {}
     except Exception as e:
         flash(f"Database error: {str(e)}", "danger")
         return {}
 
-def update_firebase_data(path, data):
+def update_firebase_data(path, data, store_id=None):
     """Safe data update with error handling"""
     try:
-        db.reference(path).update(data)
+        store_ref(path, store_id).update(data)
         return True
     except Exception as e:
         flash(f"Update failed: {str(e)}", "danger")
         return False
 
-def delete_firebase_data(path):
+def delete_firebase_data(path, store_id=None):
     """Safe deletion with error handling"""
     try:
-        db.reference(path).delete()
+        store_ref(path, store_id).delete()
         return True
     except Exception as e:
         flash(f"Deletion failed: {str(e)}", "danger")
         return False
 
+# ----------------- Reservation Helpers -----------------
+# Stock-bearing state lives in a compact per-store table, separate from the
+# catalog: stock/<pid> = {'quantity' (on hand), 'reserved' (units held by
+# carts), 'holds': {hold_id: {'qty', 'expires'}}}. One transaction on that
+# node validates and updates stock and holds together, and available-to-sell
+# is quantity - reserved from a single read. Products created before this
+# table existed carry 'quantity' on the catalog node; it seeds stock/<pid>
+# the first time the product is touched.
+#
+# To keep hot SKUs from contending on the node, each call reads it first:
+# sold-out requests are rejected from that read and holds that already
+# cover the quantity are not rewritten, so only real changes run a
+# transaction.
+_sweeper_started = False
+_sweeper_lock = threading.Lock()
+
+def stock_ref(pid, store_id=None):
+    """Database reference for a product's stock node"""
+    return store_ref(f'stock/{pid}', store_id)
+
+def get_hold_id():
+    """Stable hold owner ID for the current session"""
+    if 'hold_id' not in session:
+        session['hold_id'] = uuid.uuid4().hex
+    return session['hold_id']
+
+def _prune_holds(node, now):
+    """Drop expired holds from a stock node and recount its reserved units"""
+    node['holds'] = {
+        hold_id: hold for hold_id, hold in (node.get('holds') or {}).items()
+        if hold.get('expires', 0) > now
+    }
+    node['reserved'] = sum(hold.get('qty', 0) for hold in node['holds'].values())
+    return node
+
+def _stock_node(current, legacy_quantity, now):
+    """Pruned copy of a stock node, seeded from the catalog quantity if missing"""
+    return _prune_holds(dict(current) if current else {'quantity': legacy_quantity or 0}, now)
+
+def _hold_state(node, hold_id):
+    """This hold's entry, units held and units it could take, from a pruned node"""
+    hold = node['holds'].get(hold_id)
+    held = hold['qty'] if hold else 0
+    return hold, held, max(node.get('quantity', 0) - node['reserved'] + held, 0)
+
+def get_stock_levels(products, store_id=None):
+    """Catalog entries with 'quantity' and 'available' filled from the stock table"""
+    stock = get_firebase_data('stock', store_id) or {}
+    now = time.time()
+    merged = {}
+    for pid, product in products.items():
+        node = _stock_node(stock.get(pid), product.get('quantity', 0), now)
+        merged[pid] = dict(product, quantity=node['quantity'],
+                           available=max(node['quantity'] - node['reserved'], 0))
+    return merged
+
+def reserve_stock(pid, qty, legacy_quantity=0, store_id=None, hold_id=None):
+    """Set a hold on `qty` units of a product, replacing any previous hold.
+
+    Returns (ok, available) where available is how many units this hold
+    could take.
+    """
+    hold_id = hold_id or get_hold_id()
+    now = time.time()
+    ref = stock_ref(pid, store_id)
+
+    hold, held, available = _hold_state(_stock_node(ref.get(), legacy_quantity, now), hold_id)
+    if qty > max(held, available):
+        return False, available
+    if (not hold and qty == 0) or (
+            hold and hold['qty'] == qty and hold['expires'] - now > RESERVATION_TTL / 2):
+        return True, available
+
+    outcome = {'ok': False, 'available': 0}
+
+    def apply_hold(current):
+        node = _stock_node(current, legacy_quantity, now)
+        hold, held, available = _hold_state(node, hold_id)
+        outcome.update(ok=qty <= max(held, available), available=available)
+        if not outcome['ok']:
+            return current
+        if qty > 0:
+            node['holds'][hold_id] = {'qty': qty, 'expires': now + RESERVATION_TTL}
+        else:
+            node['holds'].pop(hold_id, None)
+        return _prune_holds(node, now)
+
+    ref.transaction(apply_hold)
+    return outcome['ok'], outcome['available']
+
+def release_stock(pid, store_id=None, hold_id=None):
+    """Drop this session's hold on a product"""
+    reserve_stock(pid, 0, 0, store_id, hold_id)
+
+def commit_reserved_stock(pid, qty, store_id=None, hold_id=None):
+    """Deduct held units from stock and drop the hold in one transaction.
+
+    Only succeeds against a live hold covering `qty` with enough stock on
+    hand; returns False otherwise and leaves quantity untouched.
+    """
+    hold_id = hold_id or get_hold_id()
+    now = time.time()
+    outcome = {'ok': False}
+
+    def apply_commit(current):
+        outcome['ok'] = False
+        if not current:
+            return current
+        node = _prune_holds(dict(current), now)
+        hold = node['holds'].get(hold_id)
+        if not hold or hold['qty'] < qty or node.get('quantity', 0) < qty:
+            return current
+        node['quantity'] -= qty
+        node['holds'].pop(hold_id)
+        outcome['ok'] = True
+        return _prune_holds(node, now)
+
+    stock_ref(pid, store_id).transaction(apply_commit)
+    return outcome['ok']
+
+def deduct_stock(pid, qty, legacy_quantity=0, store_id=None):
+    """Take unheld units straight off stock (in-store sales) in one transaction"""
+    now = time.time()
+    outcome = {'ok': False}
+
+    def apply_deduct(current):
+        node = _stock_node(current, legacy_quantity, now)
+        outcome['ok'] = node['quantity'] - node['reserved'] >= qty
+        if not outcome['ok']:
+            return current
+        node['quantity'] -= qty
+        return node
+
+    stock_ref(pid, store_id).transaction(apply_deduct)
+    return outcome['ok']
+
+def set_stock_quantity(pid, quantity, store_id=None):
+    """Set on-hand stock, keeping any holds"""
+    stock_ref(pid, store_id).transaction(lambda current: dict(current or {}, quantity=quantity))
+
+def restock(pid, qty, store_id=None):
+    """Put units back on hand, e.g. to undo a failed checkout; no-op if the product is gone"""
+    def apply_restock(current):
+        if not current:
+            return current
+        return dict(current, quantity=current.get('quantity', 0) + qty)
+
+    stock_ref(pid, store_id).transaction(apply_restock)
+
+def restock_items(items, store_id=None):
+    """Put every {pid: qty} back on hand"""
+    for pid, qty in items.items():
+        restock(pid, qty, store_id)
+
+def commit_holds(items, store_id=None, hold_id=None):
+    """Commit every {pid: qty} hold, undoing the ones already done if any fails"""
+    committed = {}
+    done = False
+    try:
+        for pid, qty in items.items():
+            if not commit_reserved_stock(pid, qty, store_id, hold_id):
+                return False
+            committed[pid] = qty
+        done = True
+        return True
+    finally:
+        if not done:
+            restock_items(committed, store_id)
+
+def deduct_items(items, products, store_id=None):
+    """Deduct every {pid: qty} from unheld stock, undoing the ones already done if any fails"""
+    deducted = {}
+    done = False
+    try:
+        for pid, qty in items.items():
+            if not deduct_stock(pid, qty, products[pid].get('quantity', 0), store_id):
+                return False
+            deducted[pid] = qty
+        done = True
+        return True
+    finally:
+        if not done:
+            restock_items(deducted, store_id)
+
+def sweep_expired_reservations(store_id):
+    """Release every expired hold in a store, one transaction per affected product"""
+    now = time.time()
+    stock = store_ref('stock', store_id).get() or {}
+    swept = 0
+    for pid, node in stock.items():
+        if any(hold.get('expires', 0) <= now for hold in (node.get('holds') or {}).values()):
+            stock_ref(pid, store_id).transaction(
+                lambda current: _prune_holds(dict(current), now) if current else current
+            )
+            swept += 1
+    return swept
+
+def _reservation_sweep_loop():
+    """Background loop releasing expired holds across all stores"""
+    while True:
+        time.sleep(RESERVATION_SWEEP_INTERVAL)
+        for store_id in STORES:
+            try:
+                sweep_expired_reservations(store_id)
+            except Exception as e:
+                app.logger.error(f"Reservation sweep failed for {store_id}: {str(e)}")
+
+@app.before_request
+def start_reservation_sweeper():
+    """Start the sweeper thread once per worker process"""
+    global _sweeper_started
+    if _sweeper_started:
+        return
+    with _sweeper_lock:
+        if not _sweeper_started:
+            threading.Thread(target=_reservation_sweep_loop, daemon=True).start()
+            _sweeper_started = True
+
+# ----------------- Profiling Helpers -----------------
+# Module prefixes used to attribute profiled time to a request phase
+PROFILE_PHASES = (
+    ('storage', ('firebase_admin', 'google', 'requests', 'urllib3', 'http/client', 'ssl', 'socket')),
+    ('render', ('jinja2', 'markupsafe')),
+    ('session', ('itsdangerous', 'flask/sessions', 'hmac', 'hashlib')),
+)
+TEMPLATE_DIR = os.path.join(app.root_path, app.template_folder).replace(os.sep, '/')
+
+# Full (cProfile) captures are per-thread up to Python 3.11. From 3.12 the
+# profiler hooks sys.monitoring and records every thread in the process
+# (other requests, the reservation sweeper, report jobs), so a per-request
+# breakdown is not possible there and 'full' falls back to 'sample'.
+PROFILE_FULL_SUPPORTED = sys.version_info < (3, 12)
+
+_profile_targets = {}
+_profile_lock = threading.Lock()
+
+def classify_phase(filename):
+    """Map a source file to storage, render, session or compute"""
+    path = filename.replace(os.sep, '/')
+    # Compiled Jinja templates report the template file as their source
+    if path.startswith(TEMPLATE_DIR + '/') or path.endswith('.html'):
+        return 'render'
+    for phase, modules in PROFILE_PHASES:
+        if any(f'/{module}/' in path or path.endswith(f'/{module}.py') for module in modules):
+            return phase
+    return 'compute'
+
+def _attribute_phase(func, stats, seen=()):
+    """Phase of a profiled function; C builtins ('~') inherit their main caller's phase"""
+    if func[0] != '~':
+        return classify_phase(func[0])
+    callers = stats.get(func, (None,) * 5)[4]
+    if not callers or func in seen:
+        return 'compute'
+    caller = max(callers, key=lambda c: callers[c][3])  # largest cumulative time
+    return _attribute_phase(caller, stats, seen + (func,))
+
+def arm_profiling(rule, count, mode='full'):
+    """Profile the next `count` requests hitting the given URL rule"""
+    with _profile_lock:
+        if count > 0:
+            _profile_targets[rule] = {'remaining': count, 'mode': mode}
+        else:
+            _profile_targets.pop(rule, None)
+
+def _claim_profile_slot(rule):
+    """Take one profiling slot for this rule, or return None when not armed"""
+    with _profile_lock:
+        target = _profile_targets.get(rule)
+        if not target:
+            return None
+        target['remaining'] -= 1
+        if target['remaining'] <= 0:
+            del _profile_targets[rule]
+        return target['mode']
+
+class StackSampler:
+    """Low-overhead sampler that records folded stacks of one thread"""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self.phases = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            # The sample belongs to the innermost frame with a known phase, so
+            # json/threading work under firebase still counts as storage
+            phase = 'compute'
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                if phase == 'compute':
+                    phase = classify_phase(code.co_filename)
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.phases[phase] += 1
+            self.stacks[';'.join(reversed(names))] += 1
+
+def _profile_basename(rule):
+    """Build a unique file stem for one profiled request"""
+    slug = rule.strip('/').replace('/', '_').replace('<', '').replace('>', '').replace(':', '-') or 'root'
+    return os.path.join(PROFILE_DIR, f"{slug}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+
+def save_profile(rule, mode, profiler, elapsed):
+    """Write the capture (pstats or folded stacks) plus a per-phase JSON summary"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = _profile_basename(rule)
+    phases = defaultdict(float)
+
+    if mode == 'sample':
+        with open(f'{base}.folded', 'w') as f:
+            for stack, count in profiler.stacks.items():
+                f.write(f'{stack} {count}\n')
+        total_samples = sum(profiler.phases.values()) or 1
+        for phase, count in profiler.phases.items():
+            phases[phase] = round(elapsed * count / total_samples, 6)
+        capture = f'{base}.folded'
+    else:
+        profiler.dump_stats(f'{base}.prof')
+        stats = pstats.Stats(profiler).stats
+        for func, (_, _, tottime, _, callers) in stats.items():
+            if func[0] == '~' and callers:
+                # socket reads, SSL, sleeps etc. count towards whoever called them
+                for caller, caller_stat in callers.items():
+                    phases[_attribute_phase(caller, stats)] += caller_stat[2]
+            else:
+                phases[classify_phase(func[0])] += tottime
+        phases = {phase: round(seconds, 6) for phase, seconds in phases.items()}
+        capture = f'{base}.prof'
+
+    with open(f'{base}.json', 'w') as f:
+        json.dump({
+            'route': rule,
+            'mode': mode,
+            'timestamp': datetime.now().isoformat(),
+            'elapsed': round(elapsed, 6),
+            'phases': dict(phases),
+            'capture': capture
+        }, f, indent=2)
+    _rotate_profiles()
+    return capture
+
+def _rotate_profiles():
+    """Delete the oldest captures beyond PROFILE_MAX_CAPTURES"""
+    summaries = sorted(
+        (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith('.json')),
+        key=os.path.getmtime
+    )
+    for summary in summaries[:-PROFILE_MAX_CAPTURES]:
+        base = summary[:-len('.json')]
+        for ext in ('.json', '.prof', '.folded'):
+            if os.path.exists(base + ext):
+                os.remove(base + ext)
+
+@app.before_request
+def start_request_profile():
+    """Start profiling when this route has been armed by an admin"""
+    if not _profile_targets or request.url_rule is None:
+        return
+    mode = _claim_profile_slot(request.url_rule.rule)
+    if mode is None:
+        return
+
+    if mode == 'full' and PROFILE_FULL_SUPPORTED:
+        try:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        except Exception as e:
+            app.logger.warning(f"Full profile unavailable, sampling instead: {str(e)}")
+            mode = 'sample'
+    else:
+        mode = 'sample'
+
+    if mode == 'sample':
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    g.profile = (request.url_rule.rule, mode, profiler, time.perf_counter())
+
+@app.teardown_request
+def finish_request_profile(error=None):
+    """Stop profiling after the response (including session signing) is finalized"""
+    capture = g.pop('profile', None)
+    if capture is None:
+        return
+    rule, mode, profiler, started = capture
+    if mode == 'sample':
+        profiler.stop()
+    else:
+        profiler.disable()
+    try:
+        save_profile(rule, mode, profiler, time.perf_counter() - started)
+    except Exception as e:
+        app.logger.error(f"Failed to save profile for {rule}: {str(e)}")
+
 # ----------------- Error Handlers -----------------
 @app.errorhandler(500)
 def internal_error(error):
@@ -159,7 +670,7 @@ def internal_error(error):
 @app.route('/')
 def home():
     """Main dashboard view"""
-    products = get_firebase_data('products')
+    products = get_stock_levels(get_firebase_data('products'))
     total_value = sum(p.get('price', 0) * p.get('quantity', 0) for p in products.values())
     return render_template('home.html',
                          products=products,
@@ -180,44 +691,52 @@ def sales():
                 flash("No products selected for sale!", "warning")
                 return redirect(url_for('sales'))
 
-            # Validate stock and calculate total
+            # Validate products and calculate total
             valid_sale = True
             sale_total = 0
-            products_ref = db.reference('products')
+            products_ref = store_ref('products')
+            sale_products = {}
             
             for pid, qty in selected_products.items():
                 product = products_ref.child(pid).get()
-                if not product or product.get('quantity', 0) < qty:
+                if not product:
                     flash(f"Invalid product selection: {pid}", "danger")
                     valid_sale = False
                     break
+                sale_products[pid] = product
                 sale_total += product.get('price', 0) * qty
 
             if not valid_sale:
                 return redirect(url_for('sales'))
 
+            # Update inventory, leaving units held by online carts alone
+            if not deduct_items(selected_products, sale_products):
+                flash("Not enough stock available for this sale", "danger")
+                return redirect(url_for('sales'))
+
             # Record sale
             sale_data = {
                 'timestamp': datetime.now().isoformat(),
                 'products': selected_products,
                 'total': sale_total,
                 'payment_method': request.form.get('payment_method', 'cash'),
-                'cashier': 'In-store'
+                'cashier': 'In-store',
+                'store': get_current_store()
             }
-            db.reference('sales').push(sale_data)
-
-            # Update inventory
-            for pid, qty in selected_products.items():
-                products_ref.child(pid).update({
-                    'quantity': db.reference(f'products/{pid}/quantity').get() - qty
-                })
+            try:
+                store_ref('sales').push(sale_data)
+            except Exception:
+                restock_items(selected_products)
+                raise
 
             flash("Sale processed successfully!", "success")
+        except db.TransactionAbortedError:
+            flash("Stock is busy right now, please retry the sale", "warning")
         except Exception as e:
             flash(f"Sale processing error: {str(e)}", "danger")
 
     # Prepare sales data for display
-    products = get_firebase_data('products')
+    products = get_stock_levels(get_firebase_data('products'))
     raw_sales = get_firebase_data('sales')
     processed_sales = {}
 
@@ -234,10 +753,27 @@ def sales():
                          products=products,
                          sales=processed_sales)
 
+@app.route('/select_store/<string:store_id>')
+def select_store(store_id):
+    """Switch the active store for this session"""
+    if store_id not in STORES:
+        flash("Unknown store", "danger")
+    else:
+        session['store_id'] = store_id
+        flash(f"Switched to {STORES[store_id]['name']}", "success")
+
+    # Go back to the previous page on this site, without a stale ?store=
+    referrer = urlsplit(request.referrer or '')
+    if (not referrer.path.startswith('/') or referrer.path.startswith('//')
+            or referrer.netloc not in ('', request.host)):
+        return redirect(url_for('home'))
+    query = urlencode([(key, value) for key, value in parse_qsl(referrer.query) if key != 'store'])
+    return redirect(urlunsplit(('', '', referrer.path, query, '')))
+
 @app.route('/store')
 def store():
     """Online store front"""
-    products = get_firebase_data('products') or {}
+    products = get_stock_levels(get_firebase_data('products') or {})
     return render_template('store.html', products=products)
 
 @app.route('/cart', methods=['GET', 'POST'])
@@ -289,10 +825,11 @@ def cart():
                         'message': 'Invalid quantity format'
                     }), 400
 
-                if product['quantity'] < new_qty:
+                reserved, available = reserve_stock(pid, new_qty, product.get('quantity', 0))
+                if not reserved:
                     return jsonify({
                         'success': False,
-                        'message': f"Only {product['quantity']} available in stock"
+                        'message': f"Only {available} available in stock"
                     }), 400
 
                 cart[pid] = new_qty
@@ -313,16 +850,19 @@ def cart():
                     }), 400
 
                 if new_qty == 0:
+                    release_stock(pid)
                     cart.pop(pid, None)
                 else:
-                    if product['quantity'] < new_qty:
+                    reserved, available = reserve_stock(pid, new_qty, product.get('quantity', 0))
+                    if not reserved:
                         return jsonify({
                             'success': False,
-                            'message': f"Only {product['quantity']} available in stock"
+                            'message': f"Only {available} available in stock"
                         }), 400
                     cart[pid] = new_qty
 
             elif action == 'remove':
+                release_stock(pid)
                 cart.pop(pid, None)
 
             else:
@@ -332,7 +872,7 @@ def cart():
                 }), 400
 
             # Update session
-            session['cart'] = cart
+            session[cart_key()] = cart
             session.modified = True
 
             return jsonify({
@@ -342,6 +882,12 @@ def cart():
                 'cart_total': calculate_cart_total()
             })
 
+        except db.TransactionAbortedError:
+            return jsonify({
+                'success': False,
+                'message': 'This item is in high demand, please try again'
+            }), 409
+
         except Exception as e:
             app.logger.error(f"Cart error: {str(e)}")
             return jsonify({
@@ -350,7 +896,7 @@ def cart():
             }), 500
 
     # GET request - show cart page
-    products = get_firebase_data('products') or {}
+    products = get_stock_levels(get_firebase_data('products') or {})
     return render_template('cart.html', products=products)
 
 
@@ -365,13 +911,17 @@ def checkout():
     
     products = get_firebase_data('products') or {}
     
-    # Validate stock
+    # Validate stock and (re)take holds for the duration of checkout
     valid = True
-    for pid, qty in cart_items.items():
-        product = products.get(pid)
-        if not product or product.get('quantity', 0) < qty:
-            flash(f"Sorry, {product['name'] if product else 'Item'} is no longer available in requested quantity", "warning")
-            valid = False
+    try:
+        for pid, qty in cart_items.items():
+            product = products.get(pid)
+            if not product or not reserve_stock(pid, qty, product.get('quantity', 0))[0]:
+                flash(f"Sorry, {product['name'] if product else 'Item'} is no longer available in requested quantity", "warning")
+                valid = False
+    except db.TransactionAbortedError:
+        flash("Some items are in high demand right now, please retry checkout", "warning")
+        valid = False
     
     if not valid:
         return redirect(url_for('cart'))
@@ -397,24 +947,29 @@ def checkout():
                 'total': sum(products[pid]['price'] * qty for pid, qty in cart_items.items()),
                 'customer': customer_data,
                 'payment_method': 'online',
-                'cashier': 'Online Store'
+                'cashier': 'Online Store',
+                'store': get_current_store()
             }
             
-            # Update inventory
-            products_ref = db.reference('products')
-            for pid, qty in cart_items.items():
-                products_ref.child(pid).update({
-                    'quantity': db.reference(f'products/{pid}/quantity').get() - qty
-                })
+            # Update inventory against this cart's holds
+            if not commit_holds(cart_items):
+                flash("Some items are no longer reserved for you, please review your cart", "warning")
+                return redirect(url_for('cart'))
             
             # Save sale and get generated ID
-            sale_ref = db.reference('sales').push(sale_data)
+            try:
+                sale_ref = store_ref('sales').push(sale_data)
+            except Exception:
+                restock_items(cart_items)
+                raise
             sale_id = sale_ref.key
             clear_cart()
             
             flash("Order placed successfully! Thank you for shopping with us.", "success")
             return redirect(url_for('generate_receipt', sale_id=sale_id))
             
+        except db.TransactionAbortedError:
+            flash("Some items are in high demand right now, please retry checkout", "warning")
         except Exception as e:
             flash(f"Checkout failed: {str(e)}", "danger")
     
@@ -428,16 +983,18 @@ def add_product():
         try:
             product_data = {
                 'name': request.form.get('name', '').strip(),
-                'quantity': int(request.form.get('quantity', 0)),
                 'price': float(request.form.get('price', 0)),
                 'images': [url.strip() for url in request.form.getlist('image_urls[]') if url.strip()][:5]
             }
+            quantity = int(request.form.get('quantity', 0))
             
             if not product_data['name']:
                 flash("Product name is required!", "danger")
                 return redirect(url_for('add_product'))
                 
-            if db.reference('products').push(product_data):
+            product_ref = store_ref('products').push(product_data)
+            if product_ref:
+                set_stock_quantity(product_ref.key, quantity)
                 flash("Product added successfully!", "success")
                 return redirect(url_for('home'))
                 
@@ -459,12 +1016,15 @@ def update_product(product_id):
     if request.method == 'POST':
         try:
             new_quantity = int(request.form.get('quantity', 0))
-            if update_firebase_data(f'products/{product_id}', {'quantity': new_quantity}):
-                flash("Quantity updated successfully!", "success")
+            set_stock_quantity(product_id, new_quantity)
+            flash("Quantity updated successfully!", "success")
             return redirect(url_for('home'))
         except ValueError:
             flash("Invalid quantity value!", "danger")
+        except Exception as e:
+            flash(f"Update failed: {str(e)}", "danger")
     
+    product = get_stock_levels({product_id: product})[product_id]
     return render_template('update_product.html', product=product)
 
 @app.route('/delete/<string:product_id>', methods=['GET', 'POST'])
@@ -476,7 +1036,7 @@ def delete_product(product_id):
         return redirect(url_for('home'))
 
     if request.method == 'POST':
-        if delete_firebase_data(f'products/{product_id}'):
+        if delete_firebase_data(f'products/{product_id}') and delete_firebase_data(f'stock/{product_id}'):
             flash("Product deleted successfully!", "success")
         return redirect(url_for('home'))
     
@@ -486,12 +1046,12 @@ def delete_product(product_id):
 def delete_zero_stock():
     """Clear out-of-stock items"""
     try:
-        products = get_firebase_data('products')
+        products = get_stock_levels(get_firebase_data('products'))
         deleted_count = 0
         
         for pid in list(products.keys()):
             if products[pid].get('quantity', 0) <= 0:
-                if delete_firebase_data(f'products/{pid}'):
+                if delete_firebase_data(f'products/{pid}') and delete_firebase_data(f'stock/{pid}'):
                     deleted_count += 1
         
         flash(f"Cleared {deleted_count} out-of-stock items!", "success")
@@ -500,6 +1060,241 @@ def delete_zero_stock():
     
     return redirect(url_for('home'))
 
+# ----------------- Report Helpers -----------------
+_report_pool = None
+_report_pool_lock = threading.Lock()
+_report_job_runner = ThreadPoolExecutor(max_workers=2)
+
+def get_report_pool():
+    """Lazily create the shared process pool for report computation"""
+    global _report_pool
+    with _report_pool_lock:
+        if _report_pool is None:
+            # forkserver: forking this multithreaded process (sweeper, job
+            # runner, firebase threads) can deadlock children on held locks
+            _report_pool = ProcessPoolExecutor(
+                max_workers=REPORT_WORKERS,
+                mp_context=multiprocessing.get_context('forkserver')
+            )
+        return _report_pool
+
+def partition_sales(all_sales, start_date, end_date, granularity='day'):
+    """Group sales by the day or month prefix of their ISO timestamp.
+
+    Partitions whose prefix falls outside the requested range are dropped
+    here, so only in-range days/months reach the workers.
+    """
+    width = 7 if granularity == 'month' else 10
+    low, high = start_date.isoformat()[:width], end_date.isoformat()[:width]
+    partitions = defaultdict(dict)
+    for sale_id, sale in all_sales.items():
+        key = sale['timestamp'][:width]
+        if low <= key <= high:
+            partitions[key][sale_id] = sale
+    return list(partitions.values())
+
+def aggregate_sales_partition(sales, product_names, start_date, end_date):
+    """Filter one partition to the date range and build its partial aggregates"""
+    partial = {
+        'sales': {},
+        'total_revenue': 0.0,
+        'products_sold': defaultdict(int),
+        'payment_methods': defaultdict(int),
+        'hourly_sales': defaultdict(float),
+        'daily_product_sales': defaultdict(lambda: defaultdict(int))
+    }
+
+    for sale_id, sale in sales.items():
+        sale_time = datetime.fromisoformat(sale['timestamp'])
+        if not start_date <= sale_time.date() <= end_date:
+            continue
+
+        partial['sales'][sale_id] = sale
+        date_key = sale_time.strftime('%Y-%m-%d')
+        hour_key = sale_time.strftime('%Y-%m-%d_%H')
+
+        sale_total = float(sale.get('total', 0))
+        partial['total_revenue'] += sale_total
+        partial['hourly_sales'][hour_key] += sale_total
+
+        payment_method = sale.get('payment_method', 'unknown').lower()
+        partial['payment_methods'][payment_method] += 1
+
+        for pid, qty in sale.get('products', {}).items():
+            product_name = product_names.get(pid, f'Deleted Product ({pid})')
+            partial['products_sold'][product_name] += qty
+            partial['daily_product_sales'][date_key][product_name] += qty
+
+    # Plain dicts so the result can be pickled back from a worker process
+    partial['products_sold'] = dict(partial['products_sold'])
+    partial['payment_methods'] = dict(partial['payment_methods'])
+    partial['hourly_sales'] = dict(partial['hourly_sales'])
+    partial['daily_product_sales'] = {
+        day: dict(counts) for day, counts in partial['daily_product_sales'].items()
+    }
+    return partial
+
+def merge_report_partials(partials):
+    """Combine partition aggregates into the analysis dict used by the template"""
+    filtered_sales = {}
+    analysis_data = {
+        'total_sales': 0,
+        'total_revenue': 0.0,
+        'products_sold': defaultdict(int),
+        'payment_methods': defaultdict(int),
+        'hourly_sales': defaultdict(float),
+        'daily_product_sales': defaultdict(lambda: defaultdict(int))
+    }
+
+    for partial in partials:
+        filtered_sales.update(partial['sales'])
+        analysis_data['total_revenue'] += partial['total_revenue']
+        for key in ('products_sold', 'payment_methods', 'hourly_sales'):
+            for name, value in partial[key].items():
+                analysis_data[key][name] += value
+        for day, counts in partial['daily_product_sales'].items():
+            for name, qty in counts.items():
+                analysis_data['daily_product_sales'][day][name] += qty
+
+    analysis_data['total_sales'] = len(filtered_sales)
+    return filtered_sales, analysis_data
+
+def build_sales_report(tasks, start_date, end_date):
+    """Compute the report over (sales, product_names) pairs, one per store shard.
+
+    Large ranges are split into date partitions and fanned out to the
+    process pool; small in-range data sets run inline to avoid pool overhead.
+    """
+    granularity = 'month' if (end_date - start_date).days > 92 else 'day'
+    chunks = [
+        (chunk, product_names)
+        for sales, product_names in tasks
+        for chunk in partition_sales(sales, start_date, end_date, granularity)
+    ]
+
+    if sum(len(chunk) for chunk, _ in chunks) < REPORT_PARALLEL_MIN_SALES or REPORT_WORKERS < 2:
+        return merge_report_partials(
+            aggregate_sales_partition(chunk, product_names, start_date, end_date)
+            for chunk, product_names in chunks
+        )
+
+    pool = get_report_pool()
+    futures = [
+        pool.submit(aggregate_sales_partition, chunk, product_names, start_date, end_date)
+        for chunk, product_names in chunks
+    ]
+    return merge_report_partials(future.result() for future in futures)
+
+def _report_store_ids(store_id):
+    """Stores covered by a report for `store_id` (which may be ALL_STORES)"""
+    return list(STORES) if store_id == ALL_STORES else [store_id]
+
+def load_report_catalog(store_id):
+    """Product catalog to show alongside a report, without any sales"""
+    if store_id != ALL_STORES:
+        return get_firebase_data('products', store_id) or {}
+    catalog = {}
+    for tree in fetch_store_trees(list(STORES), paths=('products',)).values():
+        catalog.update(tree['products'])
+    return catalog
+
+def load_report_tasks(store_id):
+    """Fetch sales and products for one store, or every store in parallel.
+
+    Returns the (sales, product_names) pairs for build_sales_report and the
+    product catalog to show alongside the report. Only the pid -> name map
+    is sent to the pool workers.
+    """
+    tasks = []
+    catalog = {}
+    for sid, tree in fetch_store_trees(_report_store_ids(store_id)).items():
+        # Tag each sale (legacy ones have no store field) so exports
+        # resolve products from the right shard
+        sales = {sale_id: dict(sale, store=sid) for sale_id, sale in tree['sales'].items()}
+        product_names = {pid: product.get('name', f'Deleted Product ({pid})')
+                         for pid, product in tree['products'].items()}
+        tasks.append((sales, product_names))
+        catalog.update(tree['products'])
+    return tasks, catalog
+
+# Job state lives in the database (default store's shard) so any server
+# worker can answer polls; the computation itself runs in the worker that
+# accepted the request.
+def report_job_ref(job_id='', tree='report_jobs'):
+    """Database reference for report job metadata or results"""
+    return store_ref('/'.join(part for part in (tree, job_id) if part), DEFAULT_STORE)
+
+def _run_report_job(job_id, store_id, start_date, end_date):
+    """Background job body: fetch the sales, compute the report and store the outcome"""
+    try:
+        tasks, products = load_report_tasks(store_id)
+        filtered_sales, analysis_data = build_sales_report(tasks, start_date, end_date)
+        # Saved as JSON strings, since product names and payment methods are
+        # not guaranteed to be valid database keys; sales are split into
+        # chunks to stay under the per-string size limit
+        sale_items = list(filtered_sales.items())
+        report_job_ref(job_id, 'report_job_results').set({
+            'analysis': json.dumps(analysis_data),
+            'products': json.dumps(products),
+            'sales': {
+                f'c{offset // REPORT_RESULT_CHUNK:05d}': json.dumps(dict(sale_items[offset:offset + REPORT_RESULT_CHUNK]))
+                for offset in range(0, len(sale_items), REPORT_RESULT_CHUNK)
+            }
+        })
+        status = {'status': 'done'}
+    except Exception as e:
+        app.logger.error(f"Report job {job_id} failed: {str(e)}")
+        status = {'status': 'failed', 'error': str(e)}
+
+    try:
+        report_job_ref(job_id).update(dict(status, finished=time.time()))
+    except Exception as e:
+        app.logger.error(f"Could not record report job {job_id}: {str(e)}")
+
+def submit_report_job(store_id, start_date, end_date, start_date_str, end_date_str):
+    """Queue a report for background computation and return its job ID"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+
+    # Drop old jobs, including ones whose worker died before finishing
+    stale = {}
+    for stale_id, job in (report_job_ref().get() or {}).items():
+        if now - job.get('finished', job.get('created', 0)) > REPORT_JOB_TTL:
+            stale[f'report_jobs/{stale_id}'] = None
+            stale[f'report_job_results/{stale_id}'] = None
+    if stale:
+        store_ref('', DEFAULT_STORE).update(stale)
+
+    report_job_ref(job_id).set({
+        'status': 'running',
+        'start_date': start_date_str,
+        'end_date': end_date_str,
+        'store': store_id,
+        'created': now
+    })
+    _report_job_runner.submit(_run_report_job, job_id, store_id, start_date, end_date)
+    return job_id
+
+def get_report_job(job_id):
+    """Look up a background report job's metadata, failing jobs that ran too long"""
+    job = get_firebase_data(f'report_jobs/{job_id}', DEFAULT_STORE)
+    if job and job.get('status') == 'running' and time.time() - job.get('created', 0) > REPORT_JOB_TIMEOUT:
+        job = dict(job, status='failed', error='Report job timed out')
+    return job
+
+def load_report_job_result(job_id):
+    """Load a finished job's sales, analysis and product catalog"""
+    result = report_job_ref(job_id, 'report_job_results').get()
+    if not result:
+        return {}, {}, {}
+    sales = {}
+    for key in sorted(result.get('sales') or {}):
+        sales.update(json.loads(result['sales'][key]))
+    # Rebuild the defaultdict-based analysis the template expects
+    analysis = json.loads(result['analysis'])
+    filtered_sales, analysis_data = merge_report_partials([dict(analysis, sales=sales)])
+    return filtered_sales, analysis_data, json.loads(result['products'])
+
 # ----------------- Reporting Routes -----------------
 @app.route('/generate_receipt/<string:sale_id>')
 def generate_receipt(sale_id):
@@ -549,8 +1344,10 @@ def sales_report():
         start_date_str = end_date_str = None
         analysis_data = {}
         filtered_sales = {}
-        products = get_firebase_data('products') or {}
-        all_sales = get_firebase_data('sales') or {}
+        products = {}
+        report_store = request.values.get('store')
+        if report_store != ALL_STORES and report_store not in STORES:
+            report_store = get_current_store()
         date_warning = False
 
         if request.method == 'POST':
@@ -573,52 +1370,23 @@ def sales_report():
                     start_date_str, end_date_str = end_date_str, start_date_str
                     date_warning = True
 
-                # Filter sales within date range
-                filtered_sales = {
-                    sale_id: sale for sale_id, sale in all_sales.items()
-                    if start_date <= datetime.fromisoformat(sale['timestamp']).date() <= end_date
-                }
+                if request.form.get('background'):
+                    job_id = submit_report_job(report_store, start_date, end_date,
+                                               start_date_str, end_date_str)
+                    return jsonify({
+                        'success': True,
+                        'job_id': job_id,
+                        'status_url': url_for('sales_report_job_status', job_id=job_id),
+                        'result_url': url_for('sales_report_job_result', job_id=job_id)
+                    }), 202
+
+                tasks, products = load_report_tasks(report_store)
+                filtered_sales, analysis_data = build_sales_report(tasks, start_date, end_date)
 
                 # Store filtered sales in session for export
+                session.pop('report_job', None)
                 session['filtered_sales'] = filtered_sales
 
-                # Initialize analysis data
-                analysis_data = {
-                    'total_sales': len(filtered_sales),
-                    'total_revenue': 0.0,
-                    'products_sold': defaultdict(int),
-                    'payment_methods': defaultdict(int),
-                    'hourly_sales': defaultdict(float),
-                    'daily_product_sales': defaultdict(lambda: defaultdict(int))
-                }
-
-                # Process sales data
-                for sale_id, sale in filtered_sales.items():
-                    # Convert timestamp
-                    sale_time = datetime.fromisoformat(sale['timestamp'])
-                    date_key = sale_time.strftime('%Y-%m-%d')
-                    hour_key = sale_time.strftime('%Y-%m-%d_%H')
-
-                    # Update financial totals
-                    sale_total = float(sale.get('total', 0))
-                    analysis_data['total_revenue'] += sale_total
-                    analysis_data['hourly_sales'][hour_key] += sale_total
-
-                    # Track payment methods
-                    payment_method = sale.get('payment_method', 'unknown').lower()
-                    analysis_data['payment_methods'][payment_method] += 1
-
-                    # Process products
-                    for pid, qty in sale.get('products', {}).items():
-                        product = products.get(pid, {'name': f'Deleted Product ({pid})'})
-                        
-                        # Update product sales
-                        product_name = product['name']
-                        analysis_data['products_sold'][product_name] += qty
-                        
-                        # Update daily product tracking
-                        analysis_data['daily_product_sales'][date_key][product_name] += qty
-
                 if date_warning:
                     flash("Date range was auto-corrected to chronological order", "warning")
 
@@ -626,10 +1394,13 @@ def sales_report():
                 app.logger.error(f"Date parsing error: {str(e)}")
                 flash("Invalid date format. Please use YYYY-MM-DD", "danger")
                 return redirect(url_for('sales_report'))
+        else:
+            products = load_report_catalog(report_store)
 
         return render_template('sales_report.html',
                             start_date=start_date_str,
                             end_date=end_date_str,
+                            report_store=report_store,
                             sales=filtered_sales,
                             analysis=analysis_data,
                             products=products,
@@ -640,12 +1411,57 @@ def sales_report():
         flash("A system error occurred while generating the report", "danger")
         return redirect(url_for('home'))
 
+@app.route('/sales_report/jobs/<string:job_id>')
+def sales_report_job_status(job_id):
+    """Poll a background report job"""
+    job = get_report_job(job_id)
+    if not job:
+        return jsonify({
+            'success': False,
+            'message': 'Report job not found'
+        }), 404
+
+    response = {'success': True, 'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'done':
+        response['result_url'] = url_for('sales_report_job_result', job_id=job_id)
+    elif job['status'] == 'failed':
+        response['message'] = job.get('error', 'Report failed')
+    return jsonify(response)
+
+@app.route('/sales_report/jobs/<string:job_id>/result')
+def sales_report_job_result(job_id):
+    """Render a finished background report"""
+    job = get_report_job(job_id)
+    if not job or job['status'] == 'failed':
+        flash("Report not available, please run it again", "danger")
+        return redirect(url_for('sales_report'))
+    if job['status'] != 'done':
+        flash("Report is still being generated", "info")
+        return redirect(url_for('sales_report'))
+
+    filtered_sales, analysis_data, products = load_report_job_result(job_id)
+
+    # Wide ranges don't fit in the session cookie; export reads the job instead
+    session.pop('filtered_sales', None)
+    session['report_job'] = job_id
+    return render_template('sales_report.html',
+                        start_date=job['start_date'],
+                        end_date=job['end_date'],
+                        report_store=job['store'],
+                        sales=filtered_sales,
+                        analysis=analysis_data,
+                        products=products,
+                        daily_product_sales=analysis_data.get('daily_product_sales', {}))
+
 @app.route('/export_report')
 def export_report():
     try:
-        # Get filtered sales from session
-        filtered_sales = session.get('filtered_sales', {})
-        products = get_firebase_data('products') or {}
+        # Get filtered sales from the last background job or the session
+        if session.get('report_job'):
+            filtered_sales = load_report_job_result(session['report_job'])[0]
+        else:
+            filtered_sales = session.get('filtered_sales', {})
+        catalogs = {}
         
         # Create CSV output
         output = StringIO()
@@ -653,18 +1469,23 @@ def export_report():
         
         # CSV Header
         writer.writerow([
-            'Sale ID', 'Date', 'Time', 'Product ID', 'Product Name',
+            'Sale ID', 'Store', 'Date', 'Time', 'Product ID', 'Product Name',
             'Quantity', 'Unit Price', 'Total', 'Payment Method', 'Customer Name', 'Phone'
         ])
         
         # CSV Rows
         for sale_id, sale in filtered_sales.items():
             sale_time = datetime.fromisoformat(sale['timestamp'])
+            store_id = sale.get('store', get_current_store())
+            if store_id not in catalogs:
+                catalogs[store_id] = get_firebase_data('products', store_id) or {}
+            products = catalogs[store_id]
             for pid, qty in sale.get('products', {}).items():
                 product = products.get(pid, {'name': 'Deleted Product', 'price': 0})
                 customer = sale.get('customer', {})
                 writer.writerow([
                     sale_id,
+                    STORES.get(store_id, {}).get('name', store_id),
                     sale_time.strftime('%Y-%m-%d'),
                     sale_time.strftime('%H:%M'),
                     pid,
@@ -690,6 +1511,62 @@ def export_report():
         flash("Failed to generate export", "danger")
         return redirect(url_for('sales_report'))
 
+# ----------------- Admin Routes -----------------
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """Arm or inspect on-demand per-route profiling"""
+    if 'user_id' not in session:
+        return jsonify({
+            'success': False,
+            'message': 'Login required'
+        }), 403
+
+    if request.method == 'POST':
+        rule = request.form.get('route', '').strip()
+        mode = request.form.get('mode', 'full')
+        try:
+            count = int(request.form.get('count', '1'))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid count'
+            }), 400
+
+        if not 0 <= count <= PROFILE_MAX_COUNT:
+            return jsonify({
+                'success': False,
+                'message': f'Count must be between 0 and {PROFILE_MAX_COUNT}'
+            }), 400
+
+        if rule not in {r.rule for r in app.url_map.iter_rules()}:
+            return jsonify({
+                'success': False,
+                'message': f'Unknown route: {rule}'
+            }), 400
+
+        if mode not in ('full', 'sample'):
+            return jsonify({
+                'success': False,
+                'message': 'Mode must be full or sample'
+            }), 400
+
+        if mode == 'full' and not PROFILE_FULL_SUPPORTED:
+            return jsonify({
+                'success': False,
+                'message': 'Full mode profiles every thread on Python 3.12+; use sample'
+            }), 400
+
+        arm_profiling(rule, count, mode)
+
+    with _profile_lock:
+        armed = {rule: dict(target) for rule, target in _profile_targets.items()}
+    captures = sorted(os.listdir(PROFILE_DIR)) if os.path.isdir(PROFILE_DIR) else []
+    return jsonify({
+        'success': True,
+        'armed': armed,
+        'captures': captures
+    })
+
 # ----------------- Authentication Routes -----------------
 @app.route('/login', methods=['GET', 'POST'])
 def login():